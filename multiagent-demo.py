@@ -1,22 +1,58 @@
 import os
+import re
+import sys
+import json
+import time
+import asyncio
+import shelve
+import hashlib
 import logging
-from typing import Dict, List
-from dataclasses import dataclass
+import functools
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Set
+from dataclasses import dataclass, field, replace
 
+import httpx
+import anthropic
 import autogen
 from autogen import Agent, GroupChat, GroupChatManager
+from autogen.agentchat.contrib.capabilities import transform_messages, transforms
+from autogen.io.base import IOStream
+from autogen.oai.anthropic import AnthropicClient
+
+from agent_prompts import (
+    ENGINEER_PARALLEL_REVIEW_SYSTEM_MESSAGE,
+    ENGINEER_SYSTEM_MESSAGE,
+    EXECUTOR_SYSTEM_MESSAGE,
+    PLANNER_SYSTEM_MESSAGE,
+    REVIEWER_SYSTEM_MESSAGE,
+)
+
+try:
+    import h2  # noqa: F401  httpx needs h2 for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(frozen=True)
 class AgentConfig:
     name: str
     system_message: str
     is_user_proxy: bool
     human_input_mode: str
-    code_execution_config: Dict = None
+    # Dicts aren't hashable; the field is still compared, just left out of the hash
+    code_execution_config: Dict = field(default=None, hash=False)
+
+_TRUTHY = frozenset({"true", "1", "t", "yes", "y"})
+
+def env_flag(name: str) -> bool:
+    """Return whether an environment variable is set to a truthy value."""
+    return os.getenv(name, "").strip().lower() in _TRUTHY
 
 # Constants
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
@@ -24,75 +60,257 @@ ANTHROPIC_MODEL = "claude-3-5-sonnet-20240620"
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = "gemma2-9b-it"
 MAX_CHAT_ROUNDS = 20
-USE_DOCKER = os.getenv("AUTOGEN_USE_DOCKER", "False").lower() in ("true", "1", "t")
+# History sent to the LLM: the task message and the latest messages
+MAX_HISTORY_MESSAGES = 5
+USE_DOCKER = env_flag("AUTOGEN_USE_DOCKER")
 API_TYPE = os.getenv("API_TYPE", "anthropic").lower()  # Default to Anthropic if not set
+STREAM_RESPONSES = env_flag("STREAM_RESPONSES")
+ENABLE_PARALLEL_REVIEW = env_flag("ENABLE_PARALLEL_REVIEW")
+EPHEMERAL_CACHE_CONTROL = {"type": "ephemeral"}
+TEMPERATURE = 0
+# Replaying cached completions is only equivalent to a fresh call when sampling is deterministic.
+CACHE_SEED = 42 if TEMPERATURE == 0 else None
+USE_SEMANTIC_CACHE = env_flag("USE_SEMANTIC_CACHE")
+SEMANTIC_CACHE_DIR = ".semantic_cache"
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# Matches the "Dear <role>" directive used to address the next speaker
+ROLE_DIRECTIVE_PATTERN = re.compile(r"Dear (user|planner|engineer|reviewer|executor)")
+# Directives are normally at the end of a message, so routing scans this many trailing characters first
+ROUTING_TAIL_BYTES = 512
+# Closes the reference data at the start of the system prompts; see system_prompt_blocks()
+REFERENCE_DATA_END = "End of reference data."
+BATCH_MAX_TOKENS = 4096
+BATCH_POLL_SECONDS = 30
 
-# Agent system messages
-PLANNER_SYSTEM_MESSAGE = """
-- Suggest a plan involving an engineer who writes code, a reviewer who checks code, and an executor who runs code.
-- Explain the plan clearly, specifying which step is performed by each participant.
-- Do not write code; ask the engineer to do this by saying "Dear engineer" before the instructions.
-- Do not review code; engineer will pass this task to the reviewer.
-- Do not run code; engineer will do this when testing code.
-- After the plan has executed successfully, ask the user to check the result by saying "Dear user"
-- Only use one instance of "Dear <role>" per message. This is used to address the next participant in the plan. This includes the entire message.
-- When starting the plan, address the first participant by saying "Dear <role>". Do not address all participants in the first message.
-"""
+TASK_MESSAGE = """
+    Please rewrite the Oracle PL/SQL function from the reference data into a python code function. Code should be written as a single program.
+    The function should return the results as a logical structure. Then print it similar to the PL/SQL output.
 
-ENGINEER_SYSTEM_MESSAGE = """
-- Follow an approved plan.
-- Write Python/Shell code to solve tasks.
-- Wrap the code in a code block that specifies the script type.
-- Write safe and secure code. This includes validating user inputs, avoiding infinite loops, and ensuring no sensitive data is exposed.
-- Include error handling if necessary. Code should be robust and able to handle edge cases.
-- Ensure the user can't modify your code; do not suggest incomplete code that requires others to modify.
-- Do not use a code block if it's not intended to be executed by the executor.
-- Do not include multiple code blocks in one response.
-- Do not ask others to copy and paste the result.
-- Check the execution result returned by the executor.
-- When ready to test the code, ask the reviewer to check it by saying "Dear reviewer."
-- Implement any suggestions made by the reviewer. If the reviewer asks for changes, output the full code again.
-- After the reviewer approves the code, test it by running it. Do this by saying "Dear executor."
-- If the result indicates an error, fix the error and output the full code again.
-- Suggest the full code instead of partial code or code changes.
-- If the error can't be fixed or if the task is not solved even after the code is executed successfully, analyze the problem, revisit your assumptions, collect additional info, and think of a different approach.
-- Document the code if necessary using Google Docstrings formatting.
-- For any 'def' functions, add unit tests at the end of the code encapsulated by comments. Also cover error cases in the unit tests.
-- Any mock data should be separate from the business logic. It should be easy to change to production data. Keep the mock data outside 'def' functions.
-"""
+    This is for testing purpose, so you don't need to make code for connecting to Oracle database. Instead use the csv data from the reference data when testing logic.
 
-REVIEWER_SYSTEM_MESSAGE = """
-- You are a reviewer.
-- Follow an approved plan.
-- Review the code written by the engineer.
-- Do not write code.
-- Follow strict style rules for code review.
-- Make sure any 'def' functions have unit tests at the end of the code encapsulated by comments.
-- Always finish feedback with "code: APPROVED" or "code: REJECTED" depending on your feedback.
-- If the code is incorrect, provide feedback to the engineer and address the engineer with "Dear engineer."
-- Reject code until you have no further improvement comments.
-- The engineer will fix the code and output the code again.
-"""
+    When you are satisfied with the code present the result to user. For the test use hardcoded CSV data from the reference data but keep it separate from the business logic. No need for logic reading for CSV-files.
+    Logic should be written so it can easily be changed to read from the production Oracle database.
 
-EXECUTOR_SYSTEM_MESSAGE = """
-- Follow an approved plan.
-- Run the code written by the engineer.
-- Do not write or review code.
-- Execute the code and return the result to the engineer.
-- If the code execution fails, provide the error message to the engineer by saying "Dear engineer."
-- Run both the code and the unit tests; all should return the expected results.
-- If the code execution is successful, return the result to the planner by saying "Dear planner."
-"""
+    The expected output for Department 1 should be:
+    ```
+    Emp ID: 201, Name: John Doe, Salary: 50000, Bonus: 5000
+    Emp ID: 202, Name: Jane Smith, Salary: 55000, Bonus: 5500
+    Total Salary for Department 1: 115500
+    ```
+    """
 
+@functools.lru_cache(maxsize=None)
 def get_file_content(file_path: str) -> str:
-    """Read and return the content of a file."""
+    """Read and return the content of a file, reading each file only once per process."""
     try:
-        with open(file_path, "r") as file:
-            return file.read()
+        return Path(file_path).read_text()
     except IOError as e:
-        logger.error(f"Error reading file {file_path}: {e}")
+        logger.error("Error reading file %s: %s", file_path, e)
         raise
 
+@functools.lru_cache(maxsize=None)
+def system_prompt_blocks(system: str) -> List[Dict]:
+    """Return the cacheable content blocks for a system prompt, built once per prompt.
+
+    AutoGen system messages are plain strings, so the reference data that leads
+    them is split off at REFERENCE_DATA_END into its own first block. Every agent
+    then shares that cached prefix, and only its role instructions differ.
+    """
+    reference_data, marker, role_message = system.partition(REFERENCE_DATA_END)
+    if not marker:
+        return [{"type": "text", "text": system, "cache_control": EPHEMERAL_CACHE_CONTROL}]
+    return [
+        {"type": "text", "text": reference_data + marker, "cache_control": EPHEMERAL_CACHE_CONTROL},
+        {"type": "text", "text": role_message, "cache_control": EPHEMERAL_CACHE_CONTROL},
+    ]
+
+@functools.lru_cache(maxsize=None)
+def system_prompt_digest(system: str) -> str:
+    """Return the sha256 of a system prompt, encoding it only once per prompt."""
+    return hashlib.sha256(system.encode("utf-8")).hexdigest()
+
+def add_cache_control(params: Dict) -> Dict:
+    """Mark the system prompt and the task message as cacheable prompt prefixes.
+
+    Anthropic caches everything up to a block carrying `cache_control`, so the
+    static system prompt and the initial task message are only processed once
+    and reused for every following round of the chat.
+    """
+    params = dict(params)
+    system = params.get("system")
+    if isinstance(system, str) and system:
+        params["system"] = system_prompt_blocks(system)
+
+    messages = params.get("messages")
+    if messages and isinstance(messages[0].get("content"), str) and messages[0]["content"]:
+        task_message = messages[0]
+        params["messages"] = [
+            {
+                **task_message,
+                "content": [
+                    {"type": "text", "text": task_message["content"], "cache_control": EPHEMERAL_CACHE_CONTROL}
+                ],
+            },
+            *messages[1:],
+        ]
+    return params
+
+class SemanticCache:
+    """Completion cache that matches prompts by embedding similarity.
+
+    Responses are persisted in a shelve store keyed by the sha256 of the prompt
+    and looked up through a FAISS inner-product index per namespace. Callers
+    scope the namespace to the system prompt and the preceding history, so a
+    reply only comes back at the same point of the same conversation.
+    """
+
+    def __init__(self, path: str, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        # Imported here so runs without the semantic cache don't pay for loading torch
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._faiss = faiss
+        self._threshold = threshold
+        self._encoder = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        self._store = shelve.open(path)
+        self._indexes: Dict[str, tuple] = {}
+        for key, (namespace, embedding, _) in self._store.items():
+            self._add_to_index(namespace, key, embedding)
+
+    def _add_to_index(self, namespace: str, key: str, embedding) -> None:
+        if namespace not in self._indexes:
+            self._indexes[namespace] = (self._faiss.IndexFlatIP(embedding.shape[1]), [])
+        index, keys = self._indexes[namespace]
+        index.add(embedding)
+        keys.append(key)
+
+    def embed(self, text: str):
+        """Return the normalized embedding of the text, so inner product is cosine similarity."""
+        return self._encoder.encode([text], normalize_embeddings=True).astype("float32")
+
+    def get(self, namespace: str, embedding):
+        """Return the cached response closest to the embedding, or None below the threshold."""
+        if namespace not in self._indexes:
+            return None
+        index, keys = self._indexes[namespace]
+        scores, ids = index.search(embedding, 1)
+        if scores[0][0] < self._threshold:
+            return None
+        return self._store[keys[ids[0][0]]][2]
+
+    def set(self, namespace: str, prompt: str, embedding, response) -> None:
+        """Store the response for the prompt."""
+        key = hashlib.sha256(f"{namespace}{prompt}".encode("utf-8")).hexdigest()
+        if key in self._store:
+            return
+        self._store[key] = (namespace, embedding, response)
+        self._store.sync()
+        self._add_to_index(namespace, key, embedding)
+
+@functools.lru_cache(maxsize=None)
+def get_semantic_cache(cache_seed: Optional[int]) -> Optional[SemanticCache]:
+    """Return the semantic cache shared by all agents for the cache seed.
+
+    Like AutoGen's own cache, a cache seed of None disables caching.
+    """
+    if not USE_SEMANTIC_CACHE or cache_seed is None:
+        return None
+    try:
+        return SemanticCache(os.path.join(SEMANTIC_CACHE_DIR, str(cache_seed)))
+    except ImportError:
+        logger.warning("USE_SEMANTIC_CACHE is set but faiss/sentence-transformers are not installed")
+        return None
+
+# Replies already printed while streaming, so the chat manager doesn't echo them again
+_streamed_replies: Set[str] = set()
+
+@functools.lru_cache(maxsize=None)
+def get_anthropic_client(api_key: str) -> anthropic.Anthropic:
+    """Return the Anthropic client shared by all agents.
+
+    All requests go through one keep-alive connection pool (HTTP/2 when h2 is
+    installed), and every Messages API call gets the prompt cache breakpoints.
+    """
+    client = anthropic.Anthropic(
+        api_key=api_key,
+        http_client=anthropic.DefaultHttpxClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        ),
+    )
+    messages = client.messages
+    messages_create = messages.create
+
+    def create_with_cache_control(**params):
+        params = add_cache_control(params)
+        if not STREAM_RESPONSES:
+            return messages_create(**params)
+
+        # Print the reply as it is generated; the chat still continues on the final message.
+        params.pop("stream", None)
+        iostream = IOStream.get_default()
+        with messages.stream(**params) as stream:
+            for text in stream.text_stream:
+                iostream.print(text, end="", flush=True)
+            iostream.print()
+            _streamed_replies.add(stream.get_final_text())
+            return stream.get_final_message()
+
+    messages.create = create_with_cache_control
+    return client
+
+class PromptCachingAnthropicClient(AnthropicClient):
+    """AutoGen Anthropic client that enables prompt caching on every request.
+
+    When the semantic cache is enabled, near-identical prompts are answered from
+    previously generated completions instead of calling the API again. With
+    STREAM_RESPONSES set, replies are streamed to the console as they arrive.
+    """
+
+    def __init__(self, config: Dict, **kwargs):
+        # AnthropicClient.__init__ always builds its own SDK client, and the attributes it sets
+        # vary between AutoGen versions, so let it run and close that client before swapping
+        # in the shared one. httpx opens no connections until a request is made.
+        super().__init__(**config)
+        self._client.close()
+        self._client = get_anthropic_client(config["api_key"])
+        self._semantic_cache = get_semantic_cache(CACHE_SEED)
+
+    def create(self, params: Dict):
+        contents = [message.get("content") for message in params["messages"]]
+        if self._semantic_cache is None or not all(isinstance(content, str) for content in contents):
+            return super().create(params)
+
+        # Don't reuse replies to code execution output; a rerun may behave differently.
+        prompt = "\n".join(contents)
+        if "exitcode:" in prompt:
+            return super().create(params)
+
+        # Revised code listings share most of their text with earlier ones, so they would
+        # match the previous review; code always has to be answered by the model.
+        if "```" in contents[-1]:
+            return super().create(params)
+
+        # Only the latest message is embedded: the encoder truncates long inputs, so
+        # embedding the whole history would collapse every prompt onto the shared prefix.
+        # The preceding history has to match exactly, so a reply is never reused at a
+        # different point of the chat (e.g. an already rejected listing for new feedback).
+        history = "\n".join([system_prompt_digest(contents[0]), *contents[1:-1]])
+        namespace = hashlib.sha256(history.encode("utf-8")).hexdigest()
+        embedding = self._semantic_cache.embed(contents[-1])
+        response = self._semantic_cache.get(namespace, embedding)
+        if response is None:
+            response = super().create(params)
+            self._semantic_cache.set(namespace, prompt, embedding, response)
+        return response
+
+def register_model_client(agent: Agent) -> None:
+    """Register the custom model client on agents using the Anthropic config."""
+    if API_TYPE == "anthropic":
+        agent.register_model_client(model_client_cls=PromptCachingAnthropicClient)
+
 def create_llm_config() -> Dict:
     """Create and return the LLM configuration based on the selected API."""
     if API_TYPE == "anthropic":
@@ -104,9 +322,11 @@ def create_llm_config() -> Dict:
                     "api_type": "anthropic",
                     "model": ANTHROPIC_MODEL,
                     "api_key": ANTHROPIC_API_KEY,
+                    "model_client_cls": PromptCachingAnthropicClient.__name__,
+                    "temperature": TEMPERATURE,
                 }
             ],
-            "cache_seed": None,
+            "cache_seed": CACHE_SEED,
         }
     elif API_TYPE == "groq":
         if not GROQ_API_KEY:
@@ -117,15 +337,28 @@ def create_llm_config() -> Dict:
                     "api_type": "groq",
                     "model": GROQ_MODEL,
                     "api_key": GROQ_API_KEY,
+                    "temperature": TEMPERATURE,
                 }
             ],
-            "cache_seed": None,
+            "cache_seed": CACHE_SEED,
         }
     else:
         raise ValueError(f"Invalid API_TYPE: {API_TYPE}. Must be 'anthropic' or 'groq'.")
 
 def create_agent(config: AgentConfig, llm_config: Dict) -> Agent:
-    """Create and return an agent based on the provided configuration."""
+    """Return the agent for the provided configuration, creating it on first use.
+
+    Agents are cached per role and LLM config, not per system message, so each
+    conversion reuses the same five agents and only updates their system message.
+    Reset them before starting a new chat.
+    """
+    agent = _create_agent(replace(config, system_message=""), json.dumps(llm_config, sort_keys=True))
+    agent.update_system_message(config.system_message)
+    return agent
+
+@functools.lru_cache(maxsize=None)
+def _create_agent(config: AgentConfig, llm_config_json: str) -> Agent:
+    llm_config = json.loads(llm_config_json)
     if config.is_user_proxy:
         return autogen.UserProxyAgent(
             name=config.name,
@@ -134,110 +367,242 @@ def create_agent(config: AgentConfig, llm_config: Dict) -> Agent:
             code_execution_config=config.code_execution_config,
         )
     else:
-        return autogen.AssistantAgent(
+        agent = autogen.AssistantAgent(
             name=config.name,
             system_message=config.system_message,
             llm_config=llm_config,
         )
+        register_model_client(agent)
+        context_handling = transform_messages.TransformMessages(
+            transforms=[
+                transforms.MessageHistoryLimiter(max_messages=MAX_HISTORY_MESSAGES, keep_first_message=True),
+            ],
+            verbose=False,
+        )
+        context_handling.add_to_agent(agent)
+        return agent
+
+class StreamingGroupChatManager(GroupChatManager):
+    """Group chat manager that doesn't echo replies already streamed to the console."""
+
+    def _print_received_message(self, message, sender, *args, **kwargs):
+        content = message.get("content") if isinstance(message, dict) else message
+        if content in _streamed_replies:
+            _streamed_replies.discard(content)
+            IOStream.get_default().print(f"{sender.name} (to {self.name}): reply streamed above\n\n{'-' * 80}", flush=True)
+            return
+        # Replies streamed as part of a combined message are printed here in full
+        _streamed_replies.difference_update({reply for reply in _streamed_replies if reply in str(content)})
+        super()._print_received_message(message, sender, *args, **kwargs)
+
+class ParallelReviewAgent(autogen.ConversableAgent):
+    """Virtual speaker that runs the reviewer and the executor concurrently.
+
+    Reviewing the code and running it don't depend on each other, so both replies
+    are generated at the same time and posted as a single message. The execution
+    result comes first so the reply still starts with the exit code line.
+    """
+
+    def __init__(self, reviewer: Agent, executor: Agent):
+        super().__init__(
+            name="ReviewerAndExecutor",
+            llm_config=False,
+            code_execution_config=False,
+            human_input_mode="NEVER",
+            description="Reviews and executes the code written by the engineer in parallel.",
+        )
+        self._reviewer = reviewer
+        self._executor = executor
+        self.register_reply([Agent, None], ParallelReviewAgent._a_generate_parallel_reply)
+
+    async def _a_generate_parallel_reply(self, messages=None, sender=None, config=None):
+        # Code execution is synchronous and never yields, so it runs in a thread to
+        # overlap with the reviewer's LLM call instead of blocking the event loop.
+        execution, review = await asyncio.gather(
+            asyncio.to_thread(self._executor.generate_reply, sender=sender),
+            self._reviewer.a_generate_reply(sender=sender),
+        )
+        replies = [reply.get("content") if isinstance(reply, dict) else reply for reply in (execution, review)]
+        return True, "\n\n".join(reply for reply in replies if reply)
 
-def custom_speaker_selection_func(last_speaker: Agent, groupchat: GroupChat) -> Agent:
+def custom_speaker_selection_func(last_speaker: Agent, groupchat: GroupChat, agent_by_role: Mapping[str, Agent]) -> Agent:
     """Select the next speaker based on the conversation flow."""
     messages = groupchat.messages
 
     if len(messages) <= 1:
-        return groupchat.agents[1]  # Planner
-    
+        return agent_by_role["planner"]
+
     last_message = messages[-1]["content"]
-    
-    speaker_map = {
-        "Dear user": groupchat.agents[0],  # User Proxy
-        "Dear planner": groupchat.agents[1],  # Planner
-        "Dear engineer": groupchat.agents[2],  # Engineer
-        "Dear reviewer": groupchat.agents[3],  # Reviewer
-        "Dear executor": groupchat.agents[4],  # Executor
-    }
 
-    for key, agent in speaker_map.items():
-        if key in last_message:
-            return agent
+    if isinstance(last_speaker, ParallelReviewAgent):
+        # The code has already run, so approved code that passed goes straight back to the planner
+        if last_message.startswith("exitcode: 0") and "code: APPROVED" in last_message:
+            return agent_by_role["planner"]
+        return agent_by_role["engineer"]
 
-    if last_speaker == groupchat.agents[4]:  # Executor
-        return groupchat.agents[2] if "exitcode: 1" in last_message else groupchat.agents[1]
+    # Scan the tail first and only fall back to the whole message when the directive isn't there
+    tail_start = max(len(last_message) - ROUTING_TAIL_BYTES, 0)
+    directive = ROLE_DIRECTIVE_PATTERN.search(last_message, tail_start) or ROLE_DIRECTIVE_PATTERN.search(last_message)
+    if directive:
+        return agent_by_role[directive.group(1)]
 
-    return groupchat.agents[1]  # Default to Planner
+    if last_speaker is agent_by_role["executor"]:
+        # The executor reply starts with the exit code line
+        return agent_by_role["engineer"] if last_message.startswith("exitcode: 1") else agent_by_role["planner"]
 
-def main():
-    # Read test data
-    plsql_script = get_file_content("testdata-sql-plsql.sql")
+    return agent_by_role["planner"]  # Default to Planner
+
+@functools.lru_cache(maxsize=None)
+def create_context_message(plsql_script: str) -> str:
+    """Create the reference data section that starts the agents' system messages, once per function."""
     tables_script = get_file_content("testdata-sql-tables.sql")
     departments_data = get_file_content("testdata-csv-departments.csv")
     employees_data = get_file_content("testdata-csv-employees.csv")
     salaries_data = get_file_content("testdata-csv-salaries.csv")
 
+    # The reference data is static for the whole chat, so it leads the cached system
+    # prompts instead of being part of the task message that is resent with the history.
+    return f"""Reference data:
+
+PL/SQL function:
+```
+{plsql_script}
+```
+
+Tables used in the PL/SQL function:
+```
+{tables_script}
+```
+
+departments.csv:
+```
+{departments_data}
+```
+employees.csv:
+```
+{employees_data}
+```
+salaries.csv:
+```
+{salaries_data}
+```
+{REFERENCE_DATA_END}
+"""
+
+def run_conversion(plsql_script: str, planner_reply: Optional[str] = None) -> autogen.ChatResult:
+    """Run the group chat that converts a PL/SQL function to Python.
+
+    If the planner's opening reply has already been generated, the chat is
+    resumed from it instead of asking the planner again.
+    """
+    context_message = create_context_message(plsql_script)
     llm_config = create_llm_config()
+    engineer_system_message = (
+        ENGINEER_PARALLEL_REVIEW_SYSTEM_MESSAGE if ENABLE_PARALLEL_REVIEW else ENGINEER_SYSTEM_MESSAGE
+    )
 
     # Create agents
     agents = [
         create_agent(AgentConfig("Admin", "A human admin.", True, "ALWAYS", None), llm_config),
-        create_agent(AgentConfig("Planner", PLANNER_SYSTEM_MESSAGE, False, "", None), llm_config),
-        create_agent(AgentConfig("Engineer", ENGINEER_SYSTEM_MESSAGE, False, "", None), llm_config),
-        create_agent(AgentConfig("Reviewer", REVIEWER_SYSTEM_MESSAGE, False, "", None), llm_config),
+        create_agent(AgentConfig("Planner", context_message + PLANNER_SYSTEM_MESSAGE, False, "", None), llm_config),
+        create_agent(AgentConfig("Engineer", context_message + engineer_system_message, False, "", None), llm_config),
+        create_agent(AgentConfig("Reviewer", context_message + REVIEWER_SYSTEM_MESSAGE, False, "", None), llm_config),
         create_agent(AgentConfig("Executor", EXECUTOR_SYSTEM_MESSAGE, True, "NEVER", {
             "last_n_messages": 3,
             "work_dir": "code",
             "use_docker": USE_DOCKER,
         }), llm_config),
     ]
+    for agent in agents:
+        agent.reset()
+
+    agent_by_role = {
+        "user": agents[0],
+        "planner": agents[1],
+        "engineer": agents[2],
+        "reviewer": agents[3],
+        "executor": agents[4],
+    }
+    if ENABLE_PARALLEL_REVIEW:
+        agent_by_role["reviewer"] = ParallelReviewAgent(reviewer=agents[3], executor=agents[4])
+        agents.append(agent_by_role["reviewer"])
 
     groupchat = GroupChat(
         agents=agents,
         messages=[],
         max_round=MAX_CHAT_ROUNDS,
-        speaker_selection_method=custom_speaker_selection_func,
+        speaker_selection_method=functools.partial(
+            custom_speaker_selection_func, agent_by_role=MappingProxyType(agent_by_role)
+        ),
     )
 
-    manager = GroupChatManager(groupchat=groupchat, llm_config=llm_config)
+    manager = StreamingGroupChatManager(groupchat=groupchat, llm_config=llm_config)
+    register_model_client(manager)
 
-    task_message = f"""
-    Please rewrite this Oracle PL/SQL function into a python code function. Code should be written as a single program.
-    The function should return the results as a logical structure. Then print it similar to the PL/SQL output.
+    sender, message, chat_kwargs = agents[0], TASK_MESSAGE, {}
+    if planner_reply is not None:
+        sender, message = manager.resume(messages=[
+            {"content": TASK_MESSAGE, "role": "user", "name": agents[0].name},
+            {"content": planner_reply, "role": "user", "name": agents[1].name},
+        ])
+        chat_kwargs["clear_history"] = False
 
-    PL/SQL function:
-    ```
-    {plsql_script}
-    ```
+    if ENABLE_PARALLEL_REVIEW:
+        return asyncio.run(sender.a_initiate_chat(manager, message=message, **chat_kwargs))
+    return sender.initiate_chat(manager, message=message, **chat_kwargs)
 
-    For context, here's the tables used in the PL/SQL function:
-    ```
-    {tables_script}
-    ```
+def run_batch(plsql_scripts: List[str]) -> List[autogen.ChatResult]:
+    """Convert several PL/SQL functions, generating the planner's opening replies in one batch.
 
-    This is for testing purpose, so you don't need to make code for connecting to Oracle database. Instead use the data from the following csv data when testing logic. The csv data contains the following data:
-    departments.csv:
-    ```
-    {departments_data}
-    ```
-    employees.csv:
-    ```
-    {employees_data}
-    ```
-    salaries.csv:
-    ```
-    {salaries_data}
-    ```
+    The opening planner turns don't depend on each other, so they are sent
+    through Anthropic's Message Batches API; each conversion then continues
+    locally from its planner reply.
+    """
+    if API_TYPE != "anthropic":
+        return [run_conversion(plsql_script) for plsql_script in plsql_scripts]
 
-    When you are satisfied with the code present the result to user. For the test use hardcoded CSV data provided above but keep it separate from the business logic. No need for logic reading for CSV-files.
-    Logic should be written so it can easily be changed to read from the production Oracle database.
+    client = get_anthropic_client(ANTHROPIC_API_KEY)
+    batch = client.messages.batches.create(requests=[
+        {
+            "custom_id": str(i),
+            "params": {
+                "model": ANTHROPIC_MODEL,
+                "max_tokens": BATCH_MAX_TOKENS,
+                "temperature": TEMPERATURE,
+                "system": system_prompt_blocks(create_context_message(plsql_script) + PLANNER_SYSTEM_MESSAGE),
+                "messages": [{"role": "user", "content": TASK_MESSAGE}],
+            },
+        }
+        for i, plsql_script in enumerate(plsql_scripts)
+    ])
+    while batch.processing_status != "ended":
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.messages.batches.retrieve(batch.id)
 
-    The expected output for Department 1 should be:
-    ```
-    Emp ID: 201, Name: John Doe, Salary: 50000, Bonus: 5000
-    Emp ID: 202, Name: Jane Smith, Salary: 55000, Bonus: 5500
-    Total Salary for Department 1: 115500
-    ```
-    """
+    planner_replies = {}
+    for entry in client.messages.batches.results(batch.id):
+        if entry.result.type == "succeeded":
+            planner_replies[entry.custom_id] = "".join(
+                block.text for block in entry.result.message.content if block.type == "text"
+            )
+        else:
+            logger.warning("Planner request %s in batch %s %s", entry.custom_id, batch.id, entry.result.type)
+
+    # Conversions without a batched planner reply ask the planner as usual
+    return [
+        run_conversion(plsql_script, planner_replies.get(str(i)))
+        for i, plsql_script in enumerate(plsql_scripts)
+    ]
 
-    agents[0].initiate_chat(manager, message=task_message)
+def main():
+    # PL/SQL files to convert can be passed as arguments; defaults to the test function
+    plsql_files = sys.argv[1:] or ["testdata-sql-plsql.sql"]
+    plsql_scripts = [get_file_content(plsql_file) for plsql_file in plsql_files]
+
+    if len(plsql_scripts) > 1:
+        run_batch(plsql_scripts)
+    else:
+        run_conversion(plsql_scripts[0])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file